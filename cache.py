@@ -0,0 +1,142 @@
+"""
+Cache Helper Functions
+
+Redis helpers used to cache hot, rarely-changing API responses.
+The client is opened from the FastAPI lifespan and stored on app.state.redis;
+when REDIS_URL is not set it is None, every helper is a no-op and callers
+fall through to MongoDB. Redis errors are logged and treated the same way,
+so a cache outage never fails a request.
+"""
+
+import hashlib
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from redis.exceptions import NoScriptError, RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+redis_url = os.getenv("REDIS_URL")
+
+PRODUCTS_CACHE_TTL = 300  # seconds
+# Bumped on every catalogue write; part of every listing key and ETag, so a
+# write orphans older entries (they expire via PRODUCTS_CACHE_TTL)
+_PRODUCTS_VERSION = "products:version"
+
+# Inquiry submissions allowed per client within the sliding window
+INQUIRY_RATE_LIMIT = int(os.getenv("INQUIRY_RATE_LIMIT", 10))
+INQUIRY_RATE_WINDOW = 60  # seconds
+
+
+def connect_cache() -> Optional[redis.Redis]:
+    """Create the Redis client for this process, or None if REDIS_URL is unset (called from the app lifespan)"""
+    if redis_url:
+        return redis.from_url(redis_url)
+    return None
+
+
+async def close_cache(r: Optional[redis.Redis]):
+    """Close the Redis client (called from the app lifespan)"""
+    if r is not None:
+        await r.aclose()
+
+
+def products_key(version: str, category: Optional[str], limit: int) -> str:
+    """Cache key for a product listing at a given catalogue version.
+
+    The category is normalised like the Mongo filter (None and "" both mean
+    unfiltered) and placed last behind a "c=" prefix, so no category string
+    can collide with another listing's key.
+    """
+    return f"products:{version}:{limit}:c={category or ''}"
+
+
+async def get_cached(r: Optional[redis.Redis], key: str) -> Optional[bytes]:
+    """Return the cached payload for key, or None on miss"""
+    if r is None:
+        return None
+    try:
+        return await r.get(key)
+    except RedisError as e:
+        logger.warning("Redis GET %s failed: %s", key, e)
+        return None
+
+
+async def set_cached_products(r: Optional[redis.Redis], key: str, payload: bytes):
+    """Cache a product listing payload"""
+    if r is None:
+        return
+    try:
+        await r.set(key, payload, ex=PRODUCTS_CACHE_TTL)
+    except RedisError as e:
+        logger.warning("Redis SET %s failed: %s", key, e)
+
+
+async def products_version(r: Optional[redis.Redis]) -> Optional[str]:
+    """Current catalogue version, or None when Redis is not configured or unreachable"""
+    if r is None:
+        return None
+    try:
+        version = await r.get(_PRODUCTS_VERSION)
+    except RedisError as e:
+        logger.warning("Redis GET %s failed: %s", _PRODUCTS_VERSION, e)
+        return None
+    return version.decode() if version else "0"
+
+
+async def invalidate_products(r: Optional[redis.Redis]):
+    """Bump the catalogue version, retiring every cached product listing"""
+    if r is None:
+        return
+    try:
+        await r.incr(_PRODUCTS_VERSION)
+    except RedisError as e:
+        # Listings may be stale for up to PRODUCTS_CACHE_TTL
+        logger.warning("Redis INCR %s failed: %s", _PRODUCTS_VERSION, e)
+
+
+# Checks every window first and records the attempt only if all are under the
+# limit, so rejected retries do not extend a client's own ban. Atomic in Redis.
+_RATE_LIMIT_SCRIPT = """
+local now, window, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+for _, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+    if redis.call('ZCARD', key) >= limit then
+        return 0
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[4])
+    redis.call('EXPIRE', key, window)
+end
+return 1
+"""
+_RATE_LIMIT_SHA = hashlib.sha1(_RATE_LIMIT_SCRIPT.encode()).hexdigest()
+
+
+async def allow_inquiry(r: Optional[redis.Redis], *client_ids: str) -> bool:
+    """Sliding-window rate limit for inquiry submissions, applied to each client id
+    (always allows without Redis or on Redis errors)"""
+    if r is None:
+        return True
+    keys = [f"rl:inq:{client_id}" for client_id in client_ids]
+    args = (time.time(), INQUIRY_RATE_WINDOW, INQUIRY_RATE_LIMIT, uuid.uuid4().hex)
+    try:
+        try:
+            # Only the script's SHA goes over the wire once Redis has it cached
+            allowed = await r.evalsha(_RATE_LIMIT_SHA, len(keys), *keys, *args)
+        except NoScriptError:
+            await r.script_load(_RATE_LIMIT_SCRIPT)
+            allowed = await r.evalsha(_RATE_LIMIT_SHA, len(keys), *keys, *args)
+    except RedisError as e:
+        logger.warning("Redis rate limit check for %s failed: %s", keys, e)
+        return True
+    return bool(allowed)
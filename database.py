@@ -3,53 +3,135 @@ Database Helper Functions
 
 MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
+The database handle is opened once per worker in the app lifespan, stored on
+app.state.db, and passed to the helpers by the handlers.
 """
 
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime, timezone
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
-_client = None
-db = None
+logger = logging.getLogger(__name__)
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Connection pool settings, per worker process (total = workers x max pool size)
+mongo_max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+mongo_min_pool_size = int(os.getenv("MONGO_MIN_POOL_SIZE", 10))
+
+
+async def connect_db() -> AsyncDatabase:
+    """Open the MongoDB client for this process and return the database (called from the app lifespan).
+
+    Fails fast when the database is misconfigured or unreachable, so the
+    helpers below can assume db is usable.
+    """
+    if not (database_url and database_name):
+        raise RuntimeError("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    client = AsyncMongoClient(
+        database_url,
+        maxPoolSize=mongo_max_pool_size,
+        minPoolSize=mongo_min_pool_size,
+        maxIdleTimeMS=60000,
+        serverSelectionTimeoutMS=3000,
+        retryWrites=True,
+        compressors="zstd,zlib",
+    )
+    db = client[database_name]
+    await db.command("ping")
+    return db
+
+
+async def ensure_indexes(db: AsyncDatabase) -> bool:
+    """Create the indexes the API queries rely on (no-op if they already exist).
+
+    A failed build is logged rather than fatal; the app still serves without it.
+    Returns whether the unique product (name, model) index is in place, so
+    callers that rely on it for de-duplication can fall back to checking first.
+    """
+    try:
+        await db["product"].create_index([("category", 1)])
+    except OperationFailure as e:
+        logger.warning("Could not create product category index: %s", e)
+
+    # Unique so duplicate products are rejected server-side. Only products with a
+    # model are constrained; several model-less products may share a name.
+    try:
+        await db["product"].create_index(
+            [("name", 1), ("model", 1)],
+            unique=True,
+            partialFilterExpression={"model": {"$type": "string"}},
+        )
+    except OperationFailure as e:
+        # Typically existing duplicate (name, model) pairs
+        logger.warning("Could not create unique product (name, model) index: %s", e)
+        return False
+    return True
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-    # Convert Pydantic model to dict if needed
+async def close_db(db: AsyncDatabase):
+    """Close the MongoDB client behind db (called from the app lifespan)"""
+    await db.client.close()
+
+
+def _prepare_document(data: Union[BaseModel, dict]) -> dict:
+    """Convert to a BSON-ready dict (copied, never mutated) and stamp timestamps"""
+    # Convert Pydantic model to dict if needed; json mode turns HttpUrl etc. into str
     if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
+        data_dict = data.model_dump(mode="json")
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
+    return data_dict
+
 
-    result = db[collection_name].insert_one(data_dict)
+# Helper functions for common database operations
+async def create_document(db: AsyncDatabase, collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    result = await db[collection_name].insert_one(_prepare_document(data))
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents(db: AsyncDatabase, collection_name: str, items: List[Union[BaseModel, dict]], ordered: bool = True):
+    """Insert several documents with timestamps in a single round trip"""
+    result = await db[collection_name].insert_many([_prepare_document(d) for d in items], ordered=ordered)
+    return [str(i) for i in result.inserted_ids]
+
+async def create_documents_ignore_duplicates(db: AsyncDatabase, collection_name: str, items: List[Union[BaseModel, dict]]) -> int:
+    """Insert documents in one unordered round trip, letting unique indexes skip duplicates.
+
+    Returns how many documents were inserted; any failure other than a
+    duplicate key (code 11000) is re-raised.
+    """
+    try:
+        return len(await create_documents(db, collection_name, items, ordered=False))
+    except BulkWriteError as bwe:
+        details = bwe.details
+        if details.get("writeConcernErrors") or any(err.get("code") != 11000 for err in details.get("writeErrors", [])):
+            raise
+        return details.get("nInserted", 0)
+
+async def get_documents(db: AsyncDatabase, collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None):
     """Get documents from collection"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return await cursor.to_list(length=limit)
+
+async def aggregate_cursor(db: AsyncDatabase, collection_name: str, pipeline: List[dict]):
+    """Run an aggregation pipeline and return its cursor, for streaming results"""
+    return await db[collection_name].aggregate(pipeline)
@@ -1,178 +1,290 @@
+import hashlib
 import os
-from fastapi import FastAPI, HTTPException
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from typing import List, Optional
 
-from database import db, create_document, get_documents
-from schemas import Product, Inquiry
+import orjson
+from pydantic import TypeAdapter
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
-app = FastAPI(title="OGX Industrial Supply API", description="B2B Oil & Gas industrial equipment supplier API")
+from cache import connect_cache, close_cache, products_key, products_version, get_cached, set_cached_products, invalidate_products, allow_inquiry, INQUIRY_RATE_WINDOW
+from database import connect_db, close_db, ensure_indexes, create_document, create_documents_ignore_duplicates, get_documents, aggregate_cursor
+from schemas import Product, ProductOut, Inquiry
+
+# Environment is fixed for the life of the process; read it once (after database loads .env)
+PORT = int(os.getenv("PORT", 8000))
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", 4))
+# Comma-separated proxy IPs trusted to set X-Forwarded-For (so request.client is the real client)
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+# Comma-separated list of frontend origins allowed to call the API
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "https://ogx.example.com").split(",") if o.strip()]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Mongo and one Redis client per worker process, bound to its event loop
+    app.state.db = await connect_db()
+    app.state.product_unique_index = await ensure_indexes(app.state.db)
+    app.state.redis = connect_cache()
+    yield
+    await close_cache(app.state.redis)
+    await close_db(app.state.db)
+
+
+app = FastAPI(
+    title="OGX Industrial Supply API",
+    description="B2B Oil & Gas industrial equipment supplier API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_credentials=False,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
 )
 
+# Product listings compress well; small responses are sent as-is
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
+
+@app.exception_handler(PyMongoError)
+async def mongo_error_handler(request: Request, exc: PyMongoError):
+    """Map any unhandled database error to 503 in one place"""
+    return ORJSONResponse(status_code=503, content={"detail": f"Database error: {str(exc)[:200]}"})
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "OGX Industrial Supply Backend is running"}
 
+# list_collection_names() result, refreshed at most every COLLECTIONS_CACHE_TTL seconds
+COLLECTIONS_CACHE_TTL = 30
+_collections_cache = {"t": float("-inf"), "v": []}  # -inf: monotonic clock may start near 0
+
+
 @app.get("/test")
-def test_database():
+async def test_database(request: Request):
     """Test endpoint to check if database is available and accessible"""
+    # Startup fails unless DATABASE_URL/DATABASE_NAME are set and Mongo answered a ping
     response = {
         "backend": "✅ Running",
-        "database": "❌ Not Available",
-        "database_url": None,
-        "database_name": None,
-        "connection_status": "Not Connected",
+        "database": "✅ Connected & Working",
+        "database_url": "✅ Set",
+        "database_name": "✅ Set",
+        "connection_status": "Connected",
         "collections": []
     }
 
     try:
-        if db is not None:
-            response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
-            response["connection_status"] = "Connected"
-            try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]
-                response["database"] = "✅ Connected & Working"
-            except Exception as e:
-                response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
-        else:
-            response["database"] = "⚠️  Available but not initialized"
+        now = time.monotonic()
+        if now - _collections_cache["t"] > COLLECTIONS_CACHE_TTL:
+            _collections_cache["v"] = await request.app.state.db.list_collection_names()
+            _collections_cache["t"] = now
+        response["collections"] = _collections_cache["v"][:10]
     except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:50]}"
+        response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
 
     return response
 
 
 # -------------------- Products Endpoints --------------------
 @app.post("/api/products", response_model=dict)
-def create_product(product: Product):
+async def create_product(request: Request, product: Product):
     try:
-        new_id = create_document("product", product)
-        return {"id": new_id}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        new_id = await create_document(request.app.state.db, "product", product)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Product with this name and model already exists")
+    await invalidate_products(request.app.state.redis)
+    return {"id": new_id}
 
 
-@app.get("/api/products", response_model=List[dict])
-def list_products(category: Optional[str] = None, limit: int = 24):
-    try:
-        filter_q = {"category": category} if category else {}
-        docs = get_documents("product", filter_q, limit)
-        # Convert ObjectId to str
-        for d in docs:
-            d["id"] = str(d.get("_id"))
-            d.pop("_id", None)
-        return docs
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+# Catalogue fields returned by listings; timestamps stay server-side
+PRODUCT_PROJECTION = {field: 1 for field in Product.model_fields}
+# Largest page a listing may request; also bounds the size of a cached listing
+PRODUCTS_MAX_LIMIT = 100
+
+
+@app.get("/api/products", response_model=List[ProductOut])
+async def list_products(request: Request, category: Optional[str] = None, limit: int = Query(24, ge=1, le=PRODUCTS_MAX_LIMIT)):
+    r = request.app.state.redis
+    version = await products_version(r)
+    # Without a version (no Redis, or Redis failing) the cache is bypassed entirely:
+    # an unversioned entry could never be retired by a write
+    key = None
+    headers = {}
+    if version is not None:
+        # Version-scoped, so a fill that races a write can never be served under the new ETag
+        key = products_key(version, category, limit)
+
+        # Weak ETag from the catalogue version: a fresh client gets a bodiless 304.
+        # The query params are hashed so the header stays ASCII and free of quotes/commas.
+        etag = f'W/"{version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+        if etag in (t.strip() for t in request.headers.get("if-none-match", "").split(",")):
+            return Response(status_code=304, headers={"ETag": etag})
+        headers["ETag"] = etag
+
+        cached = await get_cached(r, key)
+        if cached:
+            # Already serialized JSON; skip decoding and re-encoding
+            return Response(content=cached, media_type="application/json", headers=headers)
+
+    filter_q = {"category": category} if category else {}
+    # Mongo trims the fields and stringifies the ObjectId into "id"
+    pipeline = [
+        {"$match": filter_q},
+        {"$limit": limit},
+        {"$project": {**PRODUCT_PROJECTION, "_id": 0, "id": {"$toString": "$_id"}}},
+    ]
+    # Opened before streaming starts so database errors still map to 503
+    cursor = await aggregate_cursor(request.app.state.db, "product", pipeline)
+
+    async def stream():
+        # Each document is sent as soon as its batch arrives; the chunks are kept to fill the cache
+        chunks = [b"["]
+        try:
+            yield b"["
+            async for doc in cursor:
+                chunk = (b"," if len(chunks) > 1 else b"") + orjson.dumps(doc)
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            # Releases the server-side cursor if the client disconnects mid-stream
+            await cursor.close()
+        chunks.append(b"]")
+        yield b"]"
+        if key is not None:
+            await set_cached_products(r, key, b"".join(chunks))
+
+    return StreamingResponse(stream(), media_type="application/json", headers=headers)
+
+
+# Validates a whole list of products in one call to the compiled core schema
+PRODUCT_LIST_ADAPTER = TypeAdapter(List[Product])
+
+# Sample catalogue for /api/products/seed, validated and dumped once at import
+_SEED_SAMPLES: List[Product] = PRODUCT_LIST_ADAPTER.validate_python([
+    {
+        "name": "Cryogenic Solenoid Valve",
+        "category": "Cryogenic Valves",
+        "short_description": "Stainless steel cryogenic solenoid valve for LNG service",
+        "specs": {"size": "1/2\"", "rating": "Class 600", "temp": "-196°C"},
+        "image_url": None,
+        "datasheet_url": "https://example.com/datasheets/cryogenic-solenoid.pdf",
+        "brand": "CryoFlow",
+        "model": "CSV-600",
+        "in_stock": True,
+    },
+    {
+        "name": "API Process Pump",
+        "category": "Process Pumps",
+        "short_description": "Horizontal end-suction process pump per API 610",
+        "specs": {"capacity": "120 m3/h", "head": "80 m", "material": "A216 WCB"},
+        "image_url": None,
+        "datasheet_url": "https://example.com/datasheets/api610-pump.pdf",
+        "brand": "ProPump",
+        "model": "PP-610",
+        "in_stock": True,
+    },
+    {
+        "name": "Mud Logging Sensor",
+        "category": "Drilling Sensors",
+        "short_description": "Real-time drilling mud density & flow sensor",
+        "specs": {"range": "0-3 SG", "protocol": "Modbus RTU"},
+        "image_url": None,
+        "datasheet_url": "https://example.com/datasheets/mud-sensor.pdf",
+        "brand": "DrillSense",
+        "model": "MS-300",
+        "in_stock": False,
+    },
+    {
+        "name": "Cryogenic Globe Valve",
+        "category": "Cryogenic Valves",
+        "short_description": "Extended bonnet globe valve for LNG cold service",
+        "specs": {"size": "2\"", "rating": "Class 300", "material": "CF8M"},
+        "image_url": None,
+        "datasheet_url": "https://example.com/datasheets/cryogenic-globe.pdf",
+        "brand": "ArcticValve",
+        "model": "CGV-300",
+        "in_stock": True,
+    },
+    {
+        "name": "Multistage Boiler Feed Pump",
+        "category": "Process Pumps",
+        "short_description": "High-pressure boiler feed pump for utilities",
+        "specs": {"stages": "6", "pressure": "35 bar"},
+        "image_url": None,
+        "datasheet_url": "https://example.com/datasheets/boiler-feed.pdf",
+        "brand": "ThermoFlow",
+        "model": "BFP-6S",
+        "in_stock": True,
+    },
+    {
+        "name": "Downhole Pressure Sensor",
+        "category": "Drilling Sensors",
+        "short_description": "High-temp downhole pressure sensor for MWD",
+        "specs": {"pressure": "20k psi", "temp": "175°C"},
+        "image_url": None,
+        "datasheet_url": "https://example.com/datasheets/downhole-pressure.pdf",
+        "brand": "GeoProbe",
+        "model": "DPS-20K",
+        "in_stock": False,
+    },
+])
+_SEED_DUMPS: List[dict] = PRODUCT_LIST_ADAPTER.dump_python(_SEED_SAMPLES, mode="json")
+_SEED_PAIRS: List[dict] = [{"name": d["name"], "model": d["model"]} for d in _SEED_DUMPS]
 
 
 @app.post("/api/products/seed", response_model=dict)
-def seed_products():
+async def seed_products(request: Request):
     """Seed database with sample Oil & Gas products if empty or missing."""
-    try:
-        samples: List[Product] = [
-            Product(
-                name="Cryogenic Solenoid Valve",
-                category="Cryogenic Valves",
-                short_description="Stainless steel cryogenic solenoid valve for LNG service",
-                specs={"size": "1/2\"", "rating": "Class 600", "temp": "-196°C"},
-                image_url=None,
-                datasheet_url="https://example.com/datasheets/cryogenic-solenoid.pdf",
-                brand="CryoFlow",
-                model="CSV-600",
-                in_stock=True,
-            ),
-            Product(
-                name="API Process Pump",
-                category="Process Pumps",
-                short_description="Horizontal end-suction process pump per API 610",
-                specs={"capacity": "120 m3/h", "head": "80 m", "material": "A216 WCB"},
-                image_url=None,
-                datasheet_url="https://example.com/datasheets/api610-pump.pdf",
-                brand="ProPump",
-                model="PP-610",
-                in_stock=True,
-            ),
-            Product(
-                name="Mud Logging Sensor",
-                category="Drilling Sensors",
-                short_description="Real-time drilling mud density & flow sensor",
-                specs={"range": "0-3 SG", "protocol": "Modbus RTU"},
-                image_url=None,
-                datasheet_url="https://example.com/datasheets/mud-sensor.pdf",
-                brand="DrillSense",
-                model="MS-300",
-                in_stock=False,
-            ),
-            Product(
-                name="Cryogenic Globe Valve",
-                category="Cryogenic Valves",
-                short_description="Extended bonnet globe valve for LNG cold service",
-                specs={"size": "2\"", "rating": "Class 300", "material": "CF8M"},
-                image_url=None,
-                datasheet_url="https://example.com/datasheets/cryogenic-globe.pdf",
-                brand="ArcticValve",
-                model="CGV-300",
-                in_stock=True,
-            ),
-            Product(
-                name="Multistage Boiler Feed Pump",
-                category="Process Pumps",
-                short_description="High-pressure boiler feed pump for utilities",
-                specs={"stages": "6", "pressure": "35 bar"},
-                image_url=None,
-                datasheet_url="https://example.com/datasheets/boiler-feed.pdf",
-                brand="ThermoFlow",
-                model="BFP-6S",
-                in_stock=True,
-            ),
-            Product(
-                name="Downhole Pressure Sensor",
-                category="Drilling Sensors",
-                short_description="High-temp downhole pressure sensor for MWD",
-                specs={"pressure": "20k psi", "temp": "175°C"},
-                image_url=None,
-                datasheet_url="https://example.com/datasheets/downhole-pressure.pdf",
-                brand="GeoProbe",
-                model="DPS-20K",
-                in_stock=False,
-            ),
-        ]
-
-        inserted = 0
-        for p in samples:
-            # check duplicate by name+model
-            exists = get_documents("product", {"name": p.name, "model": p.model}, limit=1)
-            if not exists:
-                create_document("product", p)
-                inserted += 1
-
-        return {"status": "ok", "inserted": inserted}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    db = request.app.state.db
+    to_insert = _SEED_DUMPS
+    if not request.app.state.product_unique_index:
+        # Unique index missing (e.g. legacy duplicates): skip samples already present
+        existing = await get_documents(db, "product", {"$or": _SEED_PAIRS}, projection={"name": 1, "model": 1, "_id": 0})
+        existing_set = {(e["name"], e.get("model")) for e in existing}
+        to_insert = [d for d in _SEED_DUMPS if (d["name"], d["model"]) not in existing_set]
+
+    # The unique (name, model) index, when present, rejects samples that are already there
+    inserted = await create_documents_ignore_duplicates(db, "product", to_insert) if to_insert else 0
+
+    if inserted:
+        await invalidate_products(request.app.state.redis)
+
+    return {"status": "ok", "inserted": inserted}
 
 
 # -------------------- Inquiries (RFQ) Endpoints --------------------
 @app.post("/api/inquiries", response_model=dict)
-def create_inquiry(inquiry: Inquiry):
-    try:
-        new_id = create_document("inquiry", inquiry)
-        return {"id": new_id, "status": "received"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def create_inquiry(request: Request, inquiry: Inquiry):
+    # Throttle per client IP and per email before touching Mongo
+    client_ip = request.client.host if request.client else "unknown"
+    if not await allow_inquiry(request.app.state.redis, f"ip:{client_ip}", f"email:{inquiry.email.lower()}"):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many inquiries, please try again later",
+            headers={"Retry-After": str(INQUIRY_RATE_WINDOW)},
+        )
+    new_id = await create_document(request.app.state.db, "inquiry", inquiry)
+    return {"id": new_id, "status": "received"}
 
 
 if __name__ == "__main__":
     import uvicorn
-    port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Import string form is required by uvicorn when workers > 1
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=PORT,
+        workers=UVICORN_WORKERS,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+    )
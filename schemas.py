@@ -40,6 +40,12 @@ class Product(BaseModel):
     model: Optional[str] = Field(default=None, description="Model number")
     in_stock: bool = Field(True, description="Stock availability")
 
+class ProductOut(Product):
+    """
+    Product as returned by the listing API (not a collection)
+    """
+    id: str = Field(..., description="Product id (stringified ObjectId)")
+
 class Inquiry(BaseModel):
     """
     RFQ/Contact inquiries from website
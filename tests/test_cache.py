@@ -0,0 +1,14 @@
+from cache import products_key
+
+
+def test_products_key_unfiltered_and_literal_none_differ():
+    assert products_key("1", None, 24) != products_key("1", "None", 24)
+
+
+def test_products_key_empty_category_is_unfiltered():
+    assert products_key("1", "", 24) == products_key("1", None, 24)
+
+
+def test_products_key_scoped_by_version_and_limit():
+    assert products_key("1", "Pumps", 24) != products_key("2", "Pumps", 24)
+    assert products_key("1", "Pumps", 24) != products_key("1", "Pumps", 12)